@@ -0,0 +1,257 @@
+"""
+Mr Markovski's Roulette - Admission Control
+Per-client token buckets, a bounded in-flight limit and priority lanes
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import math
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+# Priority lanes (lower is served first)
+BETTING = 0  # Spins with active bets
+READ = 1     # Read-only routes and spins without bets
+
+LANES = (BETTING, READ)
+
+# A route's lane, or a function choosing the lane from the request body
+Lane = Union[int, Callable[[bytes], int]]
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is rate limited or shed under overload"""
+
+    def __init__(self, status_code: int, retry_after: float, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.detail = detail
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now: float) -> float:
+        """Top up tokens for the time elapsed and return the level"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def take(self, now: float) -> float:
+        """Take a token, returning 0 or the seconds until one is available"""
+        if self.refill(now) >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """
+    Admits requests into a bounded number of in-flight slots.
+
+    Each client draws from its own token bucket; the least recently seen
+    clients are forgotten once ``max_clients`` are tracked. When every slot
+    is busy, requests queue by lane and are handed the next free slot in
+    priority order. A request that has waited longer than its lane's
+    budget since it arrived is shed with a 503.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = 64,
+        rate: float = 10.0,
+        burst: float = 20.0,
+        max_queue_wait: Optional[Dict[int, float]] = None,
+        max_clients: int = 10000,
+    ):
+        self.max_in_flight = max_in_flight
+        self.rate = rate
+        self.burst = burst
+        self.max_queue_wait = max_queue_wait or {BETTING: 0.5, READ: 0.1}
+        self.max_clients = max_clients
+        self.in_flight = 0
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._waiters: List[list] = []
+        self._seq = itertools.count()
+
+    def _take_token(self, client: str, now: float):
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst, now)
+            self._buckets[client] = bucket
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+        retry_after = bucket.take(now)
+        if retry_after:
+            raise AdmissionRejected(429, retry_after, "Too many requests")
+
+    async def acquire(self, client: str, lane: int, arrival: Optional[float] = None):
+        """
+        Take an in-flight slot. A free slot is always handed out; otherwise
+        wait at most the lane's budget measured from ``arrival``. Raises
+        AdmissionRejected if not admitted.
+        """
+        now = time.monotonic()
+        if arrival is None:
+            arrival = now
+        self._take_token(client, now)
+
+        if self.in_flight < self.max_in_flight:
+            self.in_flight += 1
+            return
+        budget = self.max_queue_wait[lane]
+        remaining = budget - (now - arrival)
+        if remaining <= 0:
+            raise AdmissionRejected(503, budget, "Server overloaded")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, [lane, next(self._seq), future])
+        try:
+            await asyncio.wait_for(asyncio.shield(future), remaining)
+        except asyncio.TimeoutError:
+            if not future.done():
+                future.cancel()
+                raise AdmissionRejected(503, budget, "Server overloaded")
+            # The slot was handed over just as the budget ran out
+        except asyncio.CancelledError:
+            if future.done():
+                # Client went away after being handed a slot; pass it on
+                self.release()
+            else:
+                future.cancel()
+            raise
+
+    def release(self):
+        """Give a slot back, handing it straight to the next waiter"""
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+
+def client_address(scope: Dict) -> str:
+    """Identify the client by the connecting address"""
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def client_from_header(header: str) -> Callable[[Dict], str]:
+    """
+    Identify the client by a header set by a trusted reverse proxy, such as
+    ``x-real-ip``. For list headers like ``x-forwarded-for`` the last entry,
+    the one the nearest proxy appended, is used. Falls back to the address.
+    """
+    name = header.lower().encode("latin-1")
+
+    def client_id(scope: Dict) -> str:
+        for key, value in scope.get("headers", []):
+            if key == name:
+                return value.decode("latin-1").split(",")[-1].strip() or client_address(scope)
+        return client_address(scope)
+
+    return client_id
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware admitting matching routes through an AdmissionController.
+
+    Arrival is stamped when the request reaches the app, after its body
+    has been read for routes that need it. The slot is held until the
+    response has been sent, so time spent waiting behind other requests
+    counts against the lane budget but upload time does not. ``routes``
+    lists ``(method, path prefix, lane)``; a callable lane is given the
+    request body to pick the lane.
+    """
+
+    def __init__(
+        self,
+        app,
+        controller: AdmissionController,
+        routes: Sequence[Tuple[str, str, Lane]],
+        client_id: Callable[[Dict], str] = client_address,
+    ):
+        self.app = app
+        self.controller = controller
+        self.routes = routes
+        self.client_id = client_id
+
+    def _route_lane(self, scope: Dict) -> Optional[Lane]:
+        for method, prefix, lane in self.routes:
+            if scope["method"] == method and scope["path"].startswith(prefix):
+                return lane
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        lane = self._route_lane(scope)
+        if lane is None:
+            await self.app(scope, receive, send)
+            return
+
+        if callable(lane):
+            body, receive = await _buffer_body(receive)
+            lane = lane(body)
+        arrival = time.monotonic()
+
+        try:
+            await self.controller.acquire(self.client_id(scope), lane, arrival)
+        except AdmissionRejected as exc:
+            await _send_rejection(send, exc)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release()
+
+
+async def _buffer_body(receive):
+    """Read the whole request body and return it with a replaying receive"""
+    chunks = []
+    messages = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            # Client disconnected; replay that after the body
+            messages.append(message)
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    body = b"".join(chunks)
+    messages.insert(0, {"type": "http.request", "body": body, "more_body": False})
+
+    async def replay():
+        if messages:
+            return messages.pop(0)
+        return await receive()
+
+    return body, replay
+
+
+async def _send_rejection(send, exc: AdmissionRejected):
+    """Fail fast with Retry-After when a request is not admitted"""
+    body = json.dumps({"detail": exc.detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": exc.status_code,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(exc.retry_after).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,68 @@
+"""
+Mr Markovski's Roulette - Settlement Benchmark
+Compares spin latency with balances written inline and write-behind.
+Each spin is also fsynced to the spin log unless --no-fsync is given.
+"""
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+from typing import List
+
+import main
+from settlement import BalanceStore, Settlement
+from spin_log import SpinLog
+
+
+async def run_players(players: int, spins: int) -> List[float]:
+    """Spin concurrently from several sessions and return latencies in ms"""
+    latencies: List[float] = []
+
+    async def player(session_id: str):
+        request = main.SpinRequest(
+            bets=[main.Bet(type="red", numbers=sorted(main.RED_NUMBERS), amount=10, payout=0)],
+            balance=10000.0,
+            session_id=session_id,
+        )
+        for _ in range(spins):
+            started = time.perf_counter()
+            await main.process_spin(request)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    await asyncio.gather(*(player(f"bench-{i}") for i in range(players)))
+    return latencies
+
+
+async def bench(write_behind: bool, players: int, spins: int, write_latency: float):
+    main.settlement = Settlement(
+        BalanceStore(write_latency=write_latency),
+        write_behind=write_behind,
+    )
+    latencies = await run_players(players, spins)
+    await main.settlement.close()
+
+    latencies.sort()
+    label = "write-behind" if write_behind else "inline"
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f"{label:>12}: p50 {statistics.median(latencies):7.3f} ms   "
+          f"p99 {p99:7.3f} ms   max {latencies[-1]:7.3f} ms")
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as log_dir:
+        main.spin_log = SpinLog(log_dir, fsync=not args.no_fsync)
+        print(f"{args.players} players x {args.spins} spins, "
+              f"store write latency {args.write_latency * 1000:.1f} ms, "
+              f"fsync {'off' if args.no_fsync else 'on'}")
+        await bench(False, args.players, args.spins, args.write_latency)
+        await bench(True, args.players, args.spins, args.write_latency)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark spin settlement")
+    parser.add_argument("--players", type=int, default=20)
+    parser.add_argument("--spins", type=int, default=100)
+    parser.add_argument("--write-latency", type=float, default=0.002, help="Seconds per store write")
+    parser.add_argument("--no-fsync", action="store_true", help="Skip fsync of the spin log")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,259 @@
+"""
+Mr Markovski's Roulette - Spin Export
+Streams spins, slips and payouts from the spin log as NDJSON, CSV or Parquet
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from spin_log import SpinLog, check_timestamp
+
+# Flush output once a chunk grows past this many characters
+CHUNK_SIZE = 64 * 1024
+
+# Rows per Parquet row group
+PARQUET_BATCH_SIZE = 65536
+
+# Column name and type ("str", "int", "float" or "ints") per export kind
+SPIN_FIELDS = [
+    ("spin_id", "str"),
+    ("timestamp", "float"),
+    ("session", "str"),
+    ("winning_number", "int"),
+    ("winning_color", "str"),
+    ("total_bet", "float"),
+    ("payout", "float"),
+    ("balance", "float"),
+]
+
+SLIP_FIELDS = [
+    ("spin_id", "str"),
+    ("timestamp", "float"),
+    ("session", "str"),
+    ("bet_index", "int"),
+    ("type", "str"),
+    ("numbers", "ints"),
+    ("amount", "float"),
+]
+
+PAYOUT_FIELDS = [
+    ("spin_id", "str"),
+    ("timestamp", "float"),
+    ("session", "str"),
+    ("type", "str"),
+    ("numbers", "ints"),
+    ("amount", "float"),
+    ("payout", "float"),
+]
+
+
+def spin_records(records: Iterable[Dict]) -> Iterator[Dict]:
+    """Skip balance changes logged alongside spins"""
+    return (record for record in records if record.get("kind", "spin") == "spin")
+
+
+def spin_rows(records: Iterable[Dict]) -> Iterator[Dict]:
+    """One row per spin"""
+    for record in records:
+        yield {
+            "spin_id": record["id"],
+            "timestamp": record["timestamp"],
+            "session": record["session"],
+            "winning_number": record["winning_number"],
+            "winning_color": record["winning_color"],
+            "total_bet": record["total_bet"],
+            "payout": record["payout"],
+            "balance": record["balance"],
+        }
+
+
+def slip_rows(records: Iterable[Dict]) -> Iterator[Dict]:
+    """One row per bet placed"""
+    for record in records:
+        for index, bet in enumerate(record["bets"]):
+            yield {
+                "spin_id": record["id"],
+                "timestamp": record["timestamp"],
+                "session": record["session"],
+                "bet_index": index,
+                "type": bet["type"],
+                "numbers": bet["numbers"],
+                "amount": bet["amount"],
+            }
+
+
+def payout_rows(records: Iterable[Dict]) -> Iterator[Dict]:
+    """One row per winning bet"""
+    for record in records:
+        for bet in record["winning_bets"]:
+            yield {
+                "spin_id": record["id"],
+                "timestamp": record["timestamp"],
+                "session": record["session"],
+                "type": bet["type"],
+                "numbers": bet["numbers"],
+                "amount": bet["amount"],
+                "payout": bet["payout"],
+            }
+
+
+KINDS: Dict[str, Tuple[List[Tuple[str, str]], Callable[[Iterable[Dict]], Iterator[Dict]]]] = {
+    "spins": (SPIN_FIELDS, spin_rows),
+    "slips": (SLIP_FIELDS, slip_rows),
+    "payouts": (PAYOUT_FIELDS, payout_rows),
+}
+
+STREAM_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def chunked(pieces: Iterable[str], size: int = CHUNK_SIZE) -> Iterator[str]:
+    """Join small strings into chunks of roughly ``size`` characters"""
+    buffer: List[str] = []
+    length = 0
+    for piece in pieces:
+        buffer.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield "".join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def to_ndjson(rows: Iterable[Dict], fields: List[Tuple[str, str]]) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(row) + "\n"
+
+
+def to_csv(rows: Iterable[Dict], fields: List[Tuple[str, str]]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in fields])
+    for row in rows:
+        writer.writerow([
+            " ".join(map(str, row[name])) if kind == "ints" else row[name]
+            for name, kind in fields
+        ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+ENCODERS = {
+    "ndjson": to_ndjson,
+    "csv": to_csv,
+}
+
+
+def check_range(start: Optional[float], end: Optional[float]):
+    """Raise ValueError for unusable time bounds, before any output is sent"""
+    for bound in (start, end):
+        if bound is not None:
+            check_timestamp(bound)
+
+
+def timestamp(value: str) -> float:
+    """argparse type for --start and --end"""
+    try:
+        return check_timestamp(float(value))
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def stream(
+    spin_log: SpinLog,
+    kind: str,
+    fmt: str,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    session: Optional[str] = None,
+) -> Iterator[str]:
+    """Stream an export as text chunks"""
+    check_range(start, end)
+    fields, rows = KINDS[kind]
+    records = spin_records(spin_log.read(start=start, end=end, session=session))
+    return chunked(ENCODERS[fmt](rows(records), fields))
+
+
+def write_parquet(
+    spin_log: SpinLog,
+    kind: str,
+    path: str,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    session: Optional[str] = None,
+    batch_size: int = PARQUET_BATCH_SIZE,
+) -> int:
+    """Write an export to a Parquet file one row group at a time"""
+    check_range(start, end)
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export requires pyarrow: pip install pyarrow")
+
+    types = {
+        "str": pa.string(),
+        "int": pa.int64(),
+        "float": pa.float64(),
+        "ints": pa.list_(pa.int64()),
+    }
+    fields, rows = KINDS[kind]
+    schema = pa.schema([(name, types[kind_]) for name, kind_ in fields])
+    columns: Dict[str, List] = {name: [] for name, _ in fields}
+    count = 0
+
+    with pq.ParquetWriter(path, schema) as writer:
+        for row in rows(spin_records(spin_log.read(start=start, end=end, session=session))):
+            for name, _ in fields:
+                columns[name].append(row[name])
+            count += 1
+            if count % batch_size == 0:
+                writer.write_table(pa.table(columns, schema=schema))
+                columns = {name: [] for name, _ in fields}
+        if count % batch_size or count == 0:
+            writer.write_table(pa.table(columns, schema=schema))
+    return count
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Export spin history")
+    parser.add_argument(
+        "--log-dir",
+        default=os.environ.get("SPIN_LOG_DIR", "spin_log"),
+        help="Spin log directory",
+    )
+    parser.add_argument("--kind", choices=sorted(KINDS), default="spins")
+    parser.add_argument("--format", choices=sorted(STREAM_FORMATS) + ["parquet"], default="ndjson")
+    parser.add_argument("--start", type=timestamp, help="Start time (Unix seconds, inclusive)")
+    parser.add_argument("--end", type=timestamp, help="End time (Unix seconds, exclusive)")
+    parser.add_argument("--session", help="Only export this session")
+    parser.add_argument("--output", "-o", help="Output file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    spin_log = SpinLog(args.log_dir)
+    if args.format == "parquet":
+        if not args.output:
+            parser.error("--output is required for parquet")
+        write_parquet(spin_log, args.kind, args.output, args.start, args.end, args.session)
+        return
+
+    chunks = stream(spin_log, args.kind, args.format, args.start, args.end, args.session)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as output:
+            output.writelines(chunks)
+    else:
+        sys.stdout.writelines(chunks)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,14 +2,95 @@
 Mr Markovski's Roulette - FastAPI Backend
 Handles game logic, bet validation, and payouts
 """
+import asyncio
+import os
 import secrets
+import time
+from contextlib import asynccontextmanager
 from typing import Dict, List, Optional
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import json
 
-app = FastAPI(title="Mr Markovski's Roulette API")
+import export
+from admission import (
+    AdmissionController, AdmissionMiddleware, BETTING, READ, client_address, client_from_header
+)
+from settlement import BalanceStore, Settlement
+from spin_log import SpinLog
+
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Restore balances from the spin log, and settle what is pending on shutdown"""
+    loop = asyncio.get_running_loop()
+    await settlement.restore(await loop.run_in_executor(None, spin_log.restore))
+    yield
+    await settlement.close()
+    spin_log.close()
+
+
+app = FastAPI(title="Mr Markovski's Roulette API", lifespan=lifespan)
+
+
+def spin_lane(body: bytes) -> int:
+    """Spins with active bets go in the betting lane"""
+    try:
+        bets = json.loads(body).get("bets")
+    except (ValueError, AttributeError):
+        return READ
+    return BETTING if bets else READ
+
+
+# Admission control: bounded in-flight work per worker, betting spins first
+admission = AdmissionController(
+    max_in_flight=64,
+    rate=10.0,
+    burst=20.0,
+    max_queue_wait={BETTING: 0.5, READ: 0.1},
+)
+
+ADMISSION_ROUTES = [
+    ("POST", "/spin", spin_lane),
+    ("GET", "/history", READ),
+    ("GET", "/numbers/", READ),
+]
+
+# Exports can stream for minutes, so they get their own small pool rather
+# than holding slots that spins need
+export_admission = AdmissionController(
+    max_in_flight=2,
+    rate=1.0,
+    burst=2.0,
+    max_queue_wait={READ: 0.1},
+)
+
+EXPORT_ROUTES = [
+    ("GET", "/export", READ),
+]
+
+# Behind a reverse proxy, set ADMISSION_CLIENT_HEADER (e.g. X-Real-IP) to a
+# header the proxy sets, so each user gets their own token bucket
+ADMISSION_CLIENT_HEADER = os.environ.get("ADMISSION_CLIENT_HEADER")
+
+admission_client_id = client_from_header(ADMISSION_CLIENT_HEADER) if ADMISSION_CLIENT_HEADER else client_address
+
+# Added before CORS so rejections still carry CORS headers
+app.add_middleware(
+    AdmissionMiddleware,
+    controller=admission,
+    routes=ADMISSION_ROUTES,
+    client_id=admission_client_id,
+)
+app.add_middleware(
+    AdmissionMiddleware,
+    controller=export_admission,
+    routes=EXPORT_ROUTES,
+    client_id=admission_client_id,
+)
 
 # CORS middleware for frontend connection
 app.add_middleware(
@@ -78,7 +159,8 @@ class Bet(BaseModel):
 
 class SpinRequest(BaseModel):
     bets: List[Bet]
-    balance: float
+    balance: Optional[float] = None  # Client's view; the server balance is used
+    session_id: str = "default"
 
 
 class SpinResult(BaseModel):
@@ -91,13 +173,18 @@ class SpinResult(BaseModel):
 
 class GameState:
     def __init__(self):
-        self.balance = 10000.0
         self.last_spin = None
         self.history: List[int] = []
 
 
 game_state = GameState()
 
+# Durable record of every spin, read back by /export
+spin_log = SpinLog(os.environ.get("SPIN_LOG_DIR", "spin_log"))
+
+# Balances are settled behind the spin path, batched per session
+settlement = Settlement(BalanceStore(initial_balance=10000.0), max_delay=0.05)
+
 
 def get_color(number: int) -> str:
     """Get color of a number"""
@@ -157,6 +244,28 @@ def calculate_payout(bet: Bet, winning_number: int) -> float:
     return 0.0
 
 
+async def log_spin(session_id: str, bets: List[Bet], winning_number: int, total_bet: float,
+                   total_payout: float, new_balance: float, winning_bets: List[Dict]):
+    """Append a spin to the spin log, returning once it is on disk"""
+    await spin_log.log({
+        "kind": "spin",
+        "id": secrets.token_hex(8),
+        "timestamp": time.time(),
+        "session": session_id,
+        "winning_number": winning_number,
+        "winning_color": get_color(winning_number),
+        "total_bet": total_bet,
+        "payout": total_payout,
+        "delta": total_payout - total_bet,
+        "balance": new_balance,
+        "bets": [
+            {"type": bet.type, "numbers": bet.numbers, "amount": bet.amount}
+            for bet in bets
+        ],
+        "winning_bets": winning_bets,
+    })
+
+
 def get_neighbors(number: int, count: int) -> List[int]:
     """Get neighbors around a number on the wheel"""
     try:
@@ -174,28 +283,56 @@ def get_neighbors(number: int, count: int) -> List[int]:
 
 @app.get("/")
 async def root():
-    return {"message": "Mr Markovski's Roulette API", "status": "running"}
+    return {
+        "message": "Mr Markovski's Roulette API",
+        "status": "running",
+        "settlement": {
+            "pending_sessions": settlement.pending,
+            "staleness": round(settlement.staleness(), 3),
+        },
+    }
 
 
 @app.get("/balance")
-async def get_balance():
+async def get_balance(session_id: str = "default"):
     """Get current balance"""
-    return {"balance": game_state.balance}
+    return {"balance": settlement.balance(session_id)}
 
 
 @app.post("/balance")
-async def set_balance(balance: float):
+async def set_balance(balance: float, session_id: str = "default"):
     """Set balance (for testing/reset)"""
-    game_state.balance = balance
-    return {"balance": game_state.balance}
+    async with settlement.session(session_id):
+        await spin_log.log({
+            "kind": "balance",
+            "id": secrets.token_hex(8),
+            "timestamp": time.time(),
+            "session": session_id,
+            "delta": balance - settlement.balance(session_id),
+            "balance": balance,
+        })
+        await settlement.set(session_id, balance)
+        return {"balance": settlement.balance(session_id)}
 
 
 @app.post("/spin", response_model=SpinResult)
 async def spin(request: SpinRequest):
     """Process a spin with bets"""
+    # Finish settling even if the client goes away mid-spin
+    return await asyncio.shield(process_spin(request))
+
+
+async def process_spin(request: SpinRequest) -> SpinResult:
+    """Resolve a spin against the session balance and update game state"""
+    async with settlement.session(request.session_id):
+        return await settle_spin(request, settlement.balance(request.session_id))
+
+
+async def settle_spin(request: SpinRequest, balance: float) -> SpinResult:
+    """Resolve a spin starting from the session's current balance"""
     # Validate bets
     total_bet = sum(bet.amount for bet in request.bets)
-    if total_bet > request.balance:
+    if total_bet > balance:
         raise HTTPException(status_code=400, detail="Insufficient balance")
     
     # Generate winning number using secure RNG
@@ -218,11 +355,13 @@ async def spin(request: SpinRequest):
                 "payout": payout
             })
     
-    # Update balance
-    new_balance = request.balance - total_bet + total_payout
+    # Log the spin durably, then queue the balance change
+    new_balance = balance - total_bet + total_payout
+    await log_spin(request.session_id, request.bets, winning_number, total_bet,
+                   total_payout, new_balance, winning_bets)
+    await settlement.post(request.session_id, total_payout - total_bet)
     
     # Update game state
-    game_state.balance = new_balance
     game_state.last_spin = winning_number
     game_state.history.insert(0, winning_number)
     if len(game_state.history) > 20:
@@ -246,6 +385,31 @@ async def get_history():
     }
 
 
+@app.get("/export")
+async def export_history(
+    kind: str = "spins",
+    fmt: str = Query("ndjson", alias="format"),
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    session: Optional[str] = None,
+):
+    """Stream spins, slips or payouts as NDJSON or CSV"""
+    if kind not in export.KINDS:
+        raise HTTPException(status_code=400, detail=f"Kind must be one of {', '.join(export.KINDS)}")
+    if fmt not in export.STREAM_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Format must be one of {', '.join(export.STREAM_FORMATS)}")
+    
+    try:
+        chunks = export.stream(spin_log, kind, fmt, start=start, end=end, session=session)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(
+        chunks,
+        media_type=export.STREAM_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{kind}.{fmt}"'},
+    )
+
+
 @app.get("/numbers/{number}/neighbors")
 async def get_number_neighbors(number: int, count: int = 1):
     """Get neighbors for a number"""
@@ -272,43 +436,17 @@ async def websocket_endpoint(websocket: WebSocket):
             elif message.get("type") == "spin_request":
                 # Process spin request
                 bets = [Bet(**bet) for bet in message.get("bets", [])]
-                request = SpinRequest(bets=bets, balance=message.get("balance", 10000))
-                
-                # Generate spin
-                rng = secrets.SystemRandom()
-                winning_number = rng.choice(EUROPEAN_NUMBERS)
-                winning_color = get_color(winning_number)
-                
-                total_bet = sum(bet.amount for bet in bets)
-                total_payout = 0.0
-                winning_bets = []
-                
-                for bet in bets:
-                    payout = calculate_payout(bet, winning_number)
-                    if payout > 0:
-                        total_payout += payout
-                        winning_bets.append({
-                            "type": bet.type,
-                            "numbers": bet.numbers,
-                            "amount": bet.amount,
-                            "payout": payout
-                        })
-                
-                new_balance = request.balance - total_bet + total_payout
-                game_state.balance = new_balance
-                game_state.last_spin = winning_number
-                game_state.history.insert(0, winning_number)
-                if len(game_state.history) > 20:
-                    game_state.history.pop()
+                request = SpinRequest(
+                    bets=bets,
+                    session_id=message.get("session_id", "default"),
+                )
+                try:
+                    result = await asyncio.shield(process_spin(request))
+                except HTTPException as e:
+                    await websocket.send_json({"type": "error", "detail": e.detail})
+                    continue
                 
-                await websocket.send_json({
-                    "type": "spin_result",
-                    "winning_number": winning_number,
-                    "winning_color": winning_color,
-                    "payout": total_payout,
-                    "new_balance": new_balance,
-                    "winning_bets": winning_bets
-                })
+                await websocket.send_json({"type": "spin_result", **result.model_dump()})
     except WebSocketDisconnect:
         pass
 
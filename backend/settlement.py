@@ -0,0 +1,218 @@
+"""
+Mr Markovski's Roulette - Settlement
+Write-behind pipeline that coalesces balance changes per session
+"""
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BalanceStore:
+    """
+    Balance storage. Balances live in memory here; ``write_latency``
+    simulates the round trip to a durable store.
+    """
+
+    def __init__(self, initial_balance: float = 10000.0, write_latency: float = 0.0):
+        self.initial_balance = initial_balance
+        self.write_latency = write_latency
+        self.balances: Dict[str, float] = {}
+
+    def get(self, session_id: str) -> float:
+        return self.balances.get(session_id, self.initial_balance)
+
+    async def write(self, balances: Dict[str, float]):
+        """Write a batch of balances"""
+        if self.write_latency:
+            await asyncio.sleep(self.write_latency)
+        self.balances.update(balances)
+
+
+class Entry:
+    """Pending change for one session: an optional absolute balance plus a delta"""
+
+    __slots__ = ("base", "delta")
+
+    def __init__(self, base: Optional[float] = None, delta: float = 0.0):
+        self.base = base
+        self.delta = delta
+
+    def apply(self, balance: float) -> float:
+        return (self.base if self.base is not None else balance) + self.delta
+
+
+def _earliest(*times: Optional[float]) -> Optional[float]:
+    known = [t for t in times if t is not None]
+    return min(known) if known else None
+
+
+class Settlement:
+    """
+    Settles balance changes behind the request path.
+
+    Credits and debits are summed per session and written to the store in
+    batches, ``max_delay`` seconds after they are posted (sooner once
+    ``max_batch`` sessions are pending). If the store fails, retries back
+    off up to ``max_backoff`` and ``staleness()`` reports how long changes
+    have gone unsettled. Reads layer pending and in-flight changes over the
+    store, so they always see every posted change. With
+    ``write_behind=False`` each change is written inline.
+
+    Callers hold ``session(session_id)`` around reading a balance and
+    posting a change based on it.
+    """
+
+    def __init__(
+        self,
+        store: BalanceStore,
+        max_delay: float = 0.05,
+        max_batch: int = 256,
+        max_backoff: float = 5.0,
+        write_behind: bool = True,
+    ):
+        self.store = store
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self.max_backoff = max_backoff
+        self.write_behind = write_behind
+        self._pending: Dict[str, Entry] = {}
+        self._flushing: Dict[str, Entry] = {}
+        # Monotonic time of the oldest change in each layer
+        self._pending_since: Optional[float] = None
+        self._flushing_since: Optional[float] = None
+        self._locks: Dict[str, List] = {}
+        self._lock = asyncio.Lock()
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @asynccontextmanager
+    async def session(self, session_id: str):
+        """Serialize balance read-modify-write for one session"""
+        entry = self._locks.get(session_id)
+        if entry is None:
+            entry = self._locks[session_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[session_id]
+
+    def balance(self, session_id: str) -> float:
+        """Current balance including changes not yet written"""
+        balance = self.store.get(session_id)
+        for layer in (self._flushing, self._pending):
+            entry = layer.get(session_id)
+            if entry is not None:
+                balance = entry.apply(balance)
+        return balance
+
+    @property
+    def pending(self) -> int:
+        """Number of sessions with unsettled changes"""
+        return len(self._pending.keys() | self._flushing.keys())
+
+    def staleness(self) -> float:
+        """Seconds since the oldest unsettled change was posted"""
+        since = _earliest(self._pending_since, self._flushing_since)
+        return 0.0 if since is None else time.monotonic() - since
+
+    async def post(self, session_id: str, amount: float):
+        """Credit (positive) or debit (negative) a session"""
+        if not self.write_behind:
+            await self.store.write({session_id: self.balance(session_id) + amount})
+            return
+        entry = self._pending.setdefault(session_id, Entry())
+        entry.delta += amount
+        self._schedule()
+
+    async def set(self, session_id: str, balance: float):
+        """Replace a session's balance, superseding earlier changes"""
+        if not self.write_behind:
+            await self.store.write({session_id: balance})
+            return
+        self._pending[session_id] = Entry(base=balance)
+        self._schedule()
+
+    async def restore(self, balances: Dict[str, float]):
+        """Seed the store with balances recovered from the spin log"""
+        if balances:
+            await self.store.write(balances)
+
+    def _schedule(self):
+        if self._pending_since is None:
+            self._pending_since = time.monotonic()
+        if len(self._pending) >= self.max_batch:
+            self._full.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        delay = self.max_delay
+        while self._pending:
+            if delay > self.max_delay:
+                # Backing off; a full batch should not cut the wait short
+                await asyncio.sleep(delay)
+            else:
+                try:
+                    await asyncio.wait_for(self._full.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+            self._full.clear()
+            try:
+                await self.flush()
+            except Exception:
+                delay = min(delay * 2, self.max_backoff)
+                logger.warning(
+                    "Settlement flush failed; retrying in %.2fs with %d sessions unsettled for %.2fs",
+                    delay, self.pending, self.staleness(), exc_info=True,
+                )
+            else:
+                delay = self.max_delay
+
+    async def flush(self):
+        """Write all pending changes to the store"""
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            self._flushing = batch
+            self._flushing_since, self._pending_since = self._pending_since, None
+            try:
+                await self.store.write({
+                    session_id: entry.apply(self.store.get(session_id))
+                    for session_id, entry in batch.items()
+                })
+            except BaseException:
+                self._requeue(batch)
+                self._pending_since = _earliest(self._flushing_since, self._pending_since)
+                raise
+            finally:
+                self._flushing = {}
+                self._flushing_since = None
+
+    def _requeue(self, batch: Dict[str, Entry]):
+        """Put a failed batch back underneath changes posted since"""
+        for session_id, entry in batch.items():
+            newer = self._pending.get(session_id)
+            if newer is None:
+                self._pending[session_id] = entry
+            elif newer.base is None:
+                self._pending[session_id] = Entry(entry.base, entry.delta + newer.delta)
+
+    async def close(self):
+        """Flush remaining changes and stop the background task"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
@@ -0,0 +1,248 @@
+"""
+Mr Markovski's Roulette - Spin Log
+Append-only NDJSON log of every spin and balance change, segmented by UTC day
+"""
+import asyncio
+import json
+import math
+import os
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
+
+SNAPSHOT = "snapshot.json"
+
+
+def _day(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime("%Y-%m-%d")
+
+
+def check_timestamp(timestamp: float) -> float:
+    """Return the timestamp, or raise ValueError if it is not a usable time"""
+    if not math.isfinite(timestamp):
+        raise ValueError(f"Timestamp must be finite, got {timestamp}")
+    try:
+        _day(timestamp)
+    except (OverflowError, OSError, ValueError):
+        raise ValueError(f"Timestamp out of range: {timestamp}")
+    return timestamp
+
+
+class SpinLog:
+    """
+    Records are written one JSON object per line to ``<directory>/<day>.ndjson``.
+    Range reads only open the segments that overlap the range, so filtering
+    cost follows the size of the range rather than the whole log.
+
+    ``log`` writes from a worker thread and group-commits: records logged
+    while a write is in progress share the next write and fsync. A batch
+    that fails is cut from the log again, so no record of it is kept.
+
+    Once ``restore`` has run, the log tracks the last balance logged for
+    each session and saves it, with how far each segment has been written,
+    to ``snapshot.json`` every ``snapshot_every`` records and on close.
+    Restoring then only reads records logged after the snapshot.
+    """
+
+    def __init__(self, directory: str, fsync: bool = True, snapshot_every: int = 10000):
+        self.directory = directory
+        self.fsync = fsync
+        self.snapshot_every = snapshot_every
+        self.balances: Dict[str, float] = {}
+        self._offsets: Dict[str, int] = {}
+        self._restored = False
+        self._since_snapshot = 0
+        self._file: Optional[TextIO] = None
+        self._file_day: Optional[str] = None
+        self._queue: List[Tuple[Dict, asyncio.Future]] = []
+        self._writer: Optional[asyncio.Task] = None
+
+    def _sync(self):
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def _path(self, day: str) -> str:
+        return os.path.join(self.directory, f"{day}.ndjson")
+
+    def _open(self, day: str) -> TextIO:
+        if self._file_day != day:
+            if self._file is not None:
+                self._sync()
+                self._file.close()
+            os.makedirs(self.directory, exist_ok=True)
+            self._file = open(self._path(day), "a", encoding="utf-8")
+            self._file_day = day
+        return self._file
+
+    def write(self, records: List[Dict]):
+        """
+        Append records, each carrying a ``timestamp``, and sync them to disk.
+        If any of them fails, none are kept.
+        """
+        starts: Dict[str, int] = {}
+        ends: Dict[str, int] = {}
+        try:
+            for record in records:
+                day = _day(record["timestamp"])
+                log_file = self._open(day)
+                if day not in starts:
+                    starts[day] = ends[day] = log_file.tell()
+                line = json.dumps(record) + "\n"
+                log_file.write(line)
+                ends[day] += len(line.encode("utf-8"))
+            if self._file is not None:
+                self._sync()
+        except BaseException:
+            self._discard(starts)
+            raise
+
+        self._offsets.update(ends)
+        self._track(records)
+        self._since_snapshot += len(records)
+        if self._since_snapshot >= self.snapshot_every:
+            self.snapshot()
+
+    def _discard(self, starts: Dict[str, int]):
+        """Cut each segment back to where a failed batch started"""
+        if self._file is not None:
+            try:
+                # Closing flushes the buffer; the truncate below removes it
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+            self._file_day = None
+        for day, offset in starts.items():
+            os.truncate(self._path(day), offset)
+
+    def _track(self, records: List[Dict]):
+        for record in records:
+            if "session" in record and "balance" in record:
+                self.balances[record["session"]] = record["balance"]
+
+    def snapshot(self):
+        """Save the balances and segment offsets, if ``restore`` has run"""
+        if not self._restored:
+            # Balances logged before this process started are not known
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, SNAPSHOT)
+        with open(path + ".tmp", "w", encoding="utf-8") as snapshot:
+            json.dump({"offsets": self._offsets, "balances": self.balances}, snapshot)
+            snapshot.flush()
+            if self.fsync:
+                os.fsync(snapshot.fileno())
+        os.replace(path + ".tmp", path)
+        self._since_snapshot = 0
+
+    def restore(self) -> Dict[str, float]:
+        """
+        Return the last balance logged for each session, reading only the
+        records after the snapshot, and save a new snapshot. A partly
+        written record left by a crash is cut off. This blocks on file
+        reads, so run it in an executor.
+        """
+        balances: Dict[str, float] = {}
+        offsets: Dict[str, int] = {}
+        try:
+            with open(os.path.join(self.directory, SNAPSHOT), encoding="utf-8") as snapshot:
+                saved = json.load(snapshot)
+            balances, offsets = saved["balances"], saved["offsets"]
+        except FileNotFoundError:
+            pass
+
+        self.balances = balances
+        for path in self.segments():
+            day = os.path.basename(path)[:-len(".ndjson")]
+            end = offsets.get(day, 0)
+            with open(path, "rb") as segment:
+                segment.seek(end)
+                for line in segment:
+                    if not line.endswith(b"\n"):
+                        break
+                    self._track([json.loads(line)])
+                    end += len(line)
+            if end < os.path.getsize(path):
+                os.truncate(path, end)
+            offsets[day] = end
+        self._offsets = offsets
+        self._restored = True
+        self.snapshot()
+        return dict(self.balances)
+
+    def append(self, record: Dict):
+        """Append one record synchronously"""
+        self.write([record])
+
+    async def log(self, record: Dict):
+        """Append a record, returning once it is on disk"""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((record, future))
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._drain())
+        await future
+
+    async def _drain(self):
+        loop = asyncio.get_running_loop()
+        while self._queue:
+            batch, self._queue = self._queue, []
+            try:
+                await loop.run_in_executor(None, self.write, [record for record, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_result(None)
+
+    def close(self):
+        self.snapshot()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._file_day = None
+
+    def segments(self, start: Optional[float] = None, end: Optional[float] = None) -> List[str]:
+        """Segment paths overlapping the time range, oldest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        first = _day(start) if start is not None else None
+        last = _day(end) if end is not None else None
+        paths = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".ndjson"):
+                continue
+            day = name[:-len(".ndjson")]
+            if (first and day < first) or (last and day > last):
+                continue
+            paths.append(os.path.join(self.directory, name))
+        return paths
+
+    def read(
+        self,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        session: Optional[str] = None,
+    ) -> Iterator[Dict]:
+        """Yield spin records in [start, end), optionally for one session"""
+        # Cheap text match to skip decoding other sessions' lines
+        session_key = f'"session": {json.dumps(session)}' if session is not None else None
+        for path in self.segments(start, end):
+            with open(path, encoding="utf-8") as segment:
+                for line in segment:
+                    if not line.endswith("\n"):
+                        # Record still being written
+                        break
+                    if session_key and session_key not in line:
+                        continue
+                    record = json.loads(line)
+                    timestamp = record["timestamp"]
+                    if start is not None and timestamp < start:
+                        continue
+                    if end is not None and timestamp >= end:
+                        continue
+                    if session is not None and record.get("session") != session:
+                        continue
+                    yield record
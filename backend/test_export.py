@@ -0,0 +1,243 @@
+"""
+Tests for the spin log and streaming export
+"""
+import asyncio
+import csv
+import io
+import json
+import os
+from datetime import datetime, timezone
+
+import pytest
+
+import export
+from spin_log import SpinLog
+
+DAY = 86400
+# Noon UTC, so +/- a few hours stays on the same day
+NOON = datetime(2026, 1, 10, 12, tzinfo=timezone.utc).timestamp()
+
+
+def spin_record(spin_id, timestamp, session="a"):
+    return {
+        "id": spin_id,
+        "timestamp": timestamp,
+        "session": session,
+        "winning_number": 7,
+        "winning_color": "red",
+        "total_bet": 15.0,
+        "payout": 360.0,
+        "balance": 10345.0,
+        "bets": [
+            {"type": "straight", "numbers": [7], "amount": 10.0},
+            {"type": "split", "numbers": [8, 11], "amount": 5.0},
+        ],
+        "winning_bets": [{"type": "straight", "numbers": [7], "amount": 10.0, "payout": 360.0}],
+    }
+
+
+@pytest.fixture
+def spin_log(tmp_path):
+    log = SpinLog(str(tmp_path))
+    log.append(spin_record("d0", NOON - 2 * DAY, "a"))
+    log.append(spin_record("d1", NOON - DAY, "b"))
+    log.append(spin_record("d2-early", NOON - 3600, "a"))
+    log.append(spin_record("d2-late", NOON + 3600, "b"))
+    return log
+
+
+def exported(spin_log, kind, fmt, **filters):
+    return "".join(export.stream(spin_log, kind, fmt, **filters))
+
+
+def test_segments_are_pruned_by_time_range(spin_log):
+    names = [os.path.basename(path) for path in spin_log.segments(start=NOON - DAY, end=NOON)]
+    assert names == ["2026-01-09.ndjson", "2026-01-10.ndjson"]
+    assert len(spin_log.segments()) == 3
+    assert spin_log.segments(start=NOON + 5 * DAY) == []
+
+
+def test_ndjson_export_filters_time_and_session(spin_log):
+    lines = exported(spin_log, "spins", "ndjson", start=NOON - DAY, end=NOON).splitlines()
+    assert [json.loads(line)["spin_id"] for line in lines] == ["d1", "d2-early"]
+
+    lines = exported(spin_log, "spins", "ndjson", session="b").splitlines()
+    assert [json.loads(line)["spin_id"] for line in lines] == ["d1", "d2-late"]
+
+
+def test_csv_export_of_slips(spin_log):
+    rows = list(csv.DictReader(io.StringIO(exported(spin_log, "slips", "csv", session="a"))))
+    assert [(row["spin_id"], row["bet_index"], row["numbers"]) for row in rows] == [
+        ("d0", "0", "7"),
+        ("d0", "1", "8 11"),
+        ("d2-early", "0", "7"),
+        ("d2-early", "1", "8 11"),
+    ]
+
+
+def test_payout_rows_are_winning_bets_only(spin_log):
+    rows = [json.loads(line) for line in exported(spin_log, "payouts", "ndjson").splitlines()]
+    assert len(rows) == 4
+    assert {row["payout"] for row in rows} == {360.0}
+
+
+def test_csv_header_without_rows(tmp_path):
+    output = exported(SpinLog(str(tmp_path / "empty")), "spins", "csv")
+    assert output.strip() == ",".join(name for name, _ in export.SPIN_FIELDS)
+
+
+def test_chunked_groups_small_pieces():
+    chunks = list(export.chunked(["ab"] * 10, size=5))
+    assert "".join(chunks) == "ab" * 10
+    assert all(len(chunk) == 6 for chunk in chunks[:-1])
+
+
+def test_partially_written_line_is_not_read(spin_log):
+    with open(spin_log.segments()[-1], "a", encoding="utf-8") as segment:
+        segment.write('{"id": "torn"')
+    assert [record["id"] for record in spin_log.read()] == ["d0", "d1", "d2-early", "d2-late"]
+
+
+@pytest.mark.parametrize("bound", [1e20, -1e20, float("nan"), float("inf")])
+def test_unusable_timestamps_fail_before_streaming(spin_log, bound):
+    with pytest.raises(ValueError):
+        export.stream(spin_log, "spins", "ndjson", start=bound)
+    with pytest.raises(ValueError):
+        export.stream(spin_log, "spins", "csv", end=bound)
+
+
+def test_cli_rejects_unusable_timestamps(spin_log, capsys):
+    with pytest.raises(SystemExit):
+        export.main(["--log-dir", spin_log.directory, "--start", "nan"])
+    assert "finite" in capsys.readouterr().err
+
+
+def test_cli_writes_csv(spin_log, tmp_path):
+    output = tmp_path / "spins.csv"
+    export.main(["--log-dir", spin_log.directory, "--format", "csv", "-o", str(output)])
+    rows = list(csv.DictReader(output.open()))
+    assert [row["spin_id"] for row in rows] == ["d0", "d1", "d2-early", "d2-late"]
+
+
+@pytest.fixture
+def main_app(spin_log, monkeypatch):
+    """The FastAPI app reading from the test spin log, with admission limits lifted"""
+    pytest.importorskip("fastapi")
+    from collections import OrderedDict
+
+    import main
+    from settlement import BalanceStore, Settlement
+
+    monkeypatch.setattr(main, "spin_log", spin_log)
+    monkeypatch.setattr(main, "settlement", Settlement(BalanceStore(), max_delay=0.01))
+    for controller in (main.admission, main.export_admission):
+        monkeypatch.setattr(controller, "rate", 1e6)
+        monkeypatch.setattr(controller, "burst", 1e6)
+        monkeypatch.setattr(controller, "_buckets", OrderedDict())
+    return main
+
+
+@pytest.fixture
+def client(main_app):
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+
+    return TestClient(main_app.app)
+
+
+def test_export_endpoint_streams_ndjson(client):
+    response = client.get("/export", params={"session": "a"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.headers["content-disposition"] == 'attachment; filename="spins.ndjson"'
+    assert [json.loads(line)["spin_id"] for line in response.text.splitlines()] == ["d0", "d2-early"]
+
+
+def test_export_endpoint_streams_csv(client):
+    response = client.get("/export", params={"kind": "payouts", "format": "csv"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.headers["content-disposition"] == 'attachment; filename="payouts.csv"'
+    assert len(list(csv.DictReader(io.StringIO(response.text)))) == 4
+
+
+@pytest.mark.parametrize("params", [
+    {"kind": "bets"},
+    {"format": "xml"},
+    {"start": "1e20"},
+    {"start": "-1e20"},
+    {"end": "nan"},
+])
+def test_export_endpoint_rejects_bad_parameters(client, params):
+    response = client.get("/export", params=params)
+    assert response.status_code == 400
+    assert "detail" in response.json()
+
+
+def asgi_scope(method, path):
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"test"), (b"content-type", b"application/json")],
+        "client": ("1.2.3.4", 5000),
+        "server": ("test", 80),
+    }
+
+
+def test_export_in_progress_does_not_block_betting_spins(main_app, monkeypatch):
+    monkeypatch.setattr(main_app.admission, "max_in_flight", 1)
+    monkeypatch.setattr(main_app.export_admission, "max_in_flight", 1)
+
+    async def run():
+        export_started = asyncio.Event()
+        finish_export = asyncio.Event()
+        received = False
+
+        async def export_receive():
+            nonlocal received
+            if not received:
+                received = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await asyncio.Event().wait()
+
+        async def export_send(message):
+            if message["type"] == "http.response.start":
+                export_started.set()
+                await finish_export.wait()
+
+        export_task = asyncio.create_task(
+            main_app.app(asgi_scope("GET", "/export"), export_receive, export_send)
+        )
+        await export_started.wait()
+        assert main_app.export_admission.in_flight == 1
+
+        body = json.dumps({"bets": [{"type": "red", "numbers": [1, 3], "amount": 10, "payout": 0}]})
+        spin_messages = [{"type": "http.request", "body": body.encode(), "more_body": False}]
+        sent = []
+
+        async def spin_receive():
+            if spin_messages:
+                return spin_messages.pop()
+            await asyncio.Event().wait()
+
+        async def spin_send(message):
+            sent.append(message)
+
+        await asyncio.wait_for(
+            main_app.app(asgi_scope("POST", "/spin"), spin_receive, spin_send), 0.4
+        )
+        assert sent[0]["status"] == 200
+
+        finish_export.set()
+        await export_task
+        await main_app.settlement.close()
+        assert main_app.export_admission.in_flight == 0
+
+    asyncio.run(run())
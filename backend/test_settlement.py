@@ -0,0 +1,287 @@
+"""
+Tests for write-behind settlement and durable spin logging
+"""
+import asyncio
+import logging
+import time
+
+import pytest
+
+from settlement import BalanceStore, Settlement
+from spin_log import SpinLog
+
+
+class FlakyStore(BalanceStore):
+    """Store whose first ``failures`` writes fail after ``write_latency``"""
+
+    def __init__(self, failures=0, write_latency=0.0):
+        super().__init__(write_latency=write_latency)
+        self.failures = failures
+        self.writes = 0
+
+    async def write(self, balances):
+        self.writes += 1
+        await asyncio.sleep(self.write_latency)
+        if self.failures:
+            self.failures -= 1
+            raise IOError("store unavailable")
+        self.balances.update(balances)
+
+
+def test_reads_include_unsettled_changes():
+    async def run():
+        store = BalanceStore()
+        settlement = Settlement(store, max_delay=0.01)
+        await settlement.post("a", -10)
+        await settlement.post("a", 25)
+        await settlement.set("b", 50)
+        await settlement.post("b", 3)
+        assert settlement.balance("a") == 10015
+        assert settlement.balance("b") == 53
+        assert store.balances == {}
+        await asyncio.sleep(0.05)
+        assert store.balances == {"a": 10015, "b": 53}
+        assert settlement.pending == 0
+        assert settlement.staleness() == 0
+
+    asyncio.run(run())
+
+
+def test_changes_are_coalesced_into_one_write():
+    async def run():
+        store = FlakyStore()
+        settlement = Settlement(store, max_delay=0.01)
+        for _ in range(100):
+            await settlement.post("a", 1)
+        await settlement.close()
+        assert store.writes == 1
+        assert store.balances == {"a": 10100}
+
+    asyncio.run(run())
+
+
+def test_failed_batch_is_requeued_under_newer_changes():
+    async def run():
+        store = FlakyStore(failures=1, write_latency=0.02)
+        settlement = Settlement(store, max_delay=0.01, max_backoff=0.02)
+        await settlement.post("a", -10)
+        await settlement.set("b", 100)
+        await settlement.post("c", 5)
+        await asyncio.sleep(0.015)
+        # The first flush is in flight; post changes on top of it
+        assert settlement._flushing
+        await settlement.post("a", 1)
+        await settlement.post("b", 7)
+        await settlement.set("c", 42)
+        assert settlement.balance("a") == 9991
+        assert settlement.balance("b") == 107
+        assert settlement.balance("c") == 42
+
+        await asyncio.sleep(0.03)
+        # The flush failed; reads still see every change
+        assert store.writes == 1 and store.balances == {}
+        assert settlement.balance("a") == 9991
+        assert settlement.balance("b") == 107
+
+        await settlement.close()
+        assert store.balances == {"a": 9991, "b": 107, "c": 42}
+
+    asyncio.run(run())
+
+
+def test_failing_store_backs_off_and_reports_staleness(caplog):
+    async def run():
+        store = FlakyStore(failures=1000)
+        settlement = Settlement(store, max_delay=0.01, max_backoff=0.08)
+        await settlement.post("a", 1)
+        await asyncio.sleep(0.3)
+        # Without backoff this would be ~30 attempts
+        assert 3 <= store.writes <= 8
+        assert settlement.staleness() >= 0.25
+        assert settlement.pending == 1
+        assert settlement.balance("a") == 10001
+        settlement._task.cancel()
+
+    with caplog.at_level(logging.WARNING, logger="settlement"):
+        asyncio.run(run())
+    assert "Settlement flush failed" in caplog.text
+
+
+def test_inline_writes_only_serialize_per_session():
+    async def run():
+        store = BalanceStore(write_latency=0.02)
+        settlement = Settlement(store, write_behind=False)
+
+        async def credit(session_id):
+            async with settlement.session(session_id):
+                await settlement.post(session_id, 1)
+
+        started = time.monotonic()
+        await asyncio.gather(*(credit(f"s{i}") for i in range(10)))
+        assert time.monotonic() - started < 0.1
+        assert all(balance == 10001 for balance in store.balances.values())
+
+        await asyncio.gather(*(credit("same") for _ in range(5)))
+        assert store.balances["same"] == 10005
+        assert settlement._locks == {}
+
+    asyncio.run(run())
+
+
+def test_restore_reads_only_records_after_the_snapshot(tmp_path, monkeypatch):
+    async def run():
+        spin_log = SpinLog(str(tmp_path))
+        spin_log.restore()
+        now = time.time()
+        for i, (session_id, balance) in enumerate([("a", 990), ("b", 500), ("a", 1025)]):
+            await spin_log.log({"timestamp": now + i, "session": session_id,
+                                "delta": 0, "balance": balance})
+        spin_log.close()
+
+        # Logged after the snapshot, then a crash mid-write
+        after = SpinLog(str(tmp_path))
+        after.append({"timestamp": now, "session": "b", "delta": 0, "balance": 480})
+        after.close()
+        with open(after.segments()[-1], "a", encoding="utf-8") as segment:
+            segment.write('{"session": "b", "bal')
+
+        restored = SpinLog(str(tmp_path))
+        decoded = []
+        track = restored._track
+        monkeypatch.setattr(restored, "_track", lambda records: decoded.extend(records) or track(records))
+        settlement = Settlement(BalanceStore())
+        await settlement.restore(restored.restore())
+        assert len(decoded) == 1
+        assert settlement.balance("a") == 1025
+        assert settlement.balance("b") == 480
+
+        # The torn record is cut off, so later records stay readable
+        monkeypatch.undo()
+        await restored.log({"timestamp": now, "session": "a", "delta": 0, "balance": 1000})
+        restored.close()
+        assert [record["balance"] for record in SpinLog(str(tmp_path)).read()] == [
+            990, 500, 1025, 480, 1000,
+        ]
+        assert SpinLog(str(tmp_path)).restore() == {"a": 1000, "b": 480}
+
+    asyncio.run(run())
+
+
+def test_snapshot_is_saved_while_running(tmp_path):
+    spin_log = SpinLog(str(tmp_path), snapshot_every=2)
+    spin_log.restore()
+    now = time.time()
+    for balance in (1, 2, 3):
+        spin_log.append({"timestamp": now, "session": "a", "delta": 0, "balance": balance})
+    # No close: only the record after the last snapshot is read back
+    restored = SpinLog(str(tmp_path))
+    decoded = []
+    track = restored._track
+    restored._track = lambda records: decoded.extend(records) or track(records)
+    assert restored.restore() == {"a": 3}
+    assert [record["balance"] for record in decoded] == [3]
+
+
+def test_spin_log_group_commits(tmp_path, monkeypatch):
+    async def run():
+        spin_log = SpinLog(str(tmp_path))
+        calls = []
+        write = spin_log.write
+
+        def counting_write(records):
+            calls.append(len(records))
+            write(records)
+
+        monkeypatch.setattr(spin_log, "write", counting_write)
+        now = time.time()
+        await asyncio.gather(*(
+            spin_log.log({"timestamp": now, "session": "a", "n": n}) for n in range(50)
+        ))
+        spin_log.close()
+        assert sum(calls) == 50
+        assert len(calls) < 50
+        assert [record["n"] for record in SpinLog(str(tmp_path)).read()] == list(range(50))
+
+    asyncio.run(run())
+
+
+def test_spin_log_errors_reach_every_waiter(tmp_path):
+    async def run():
+        blocker = tmp_path / "blocked"
+        blocker.write_text("")
+        spin_log = SpinLog(str(blocker / "log"))
+        results = await asyncio.gather(
+            *(spin_log.log({"timestamp": time.time()}) for _ in range(3)),
+            return_exceptions=True,
+        )
+        assert all(isinstance(result, OSError) for result in results)
+
+    asyncio.run(run())
+
+
+def test_failed_batch_leaves_no_records(tmp_path, monkeypatch):
+    async def run():
+        spin_log = SpinLog(str(tmp_path))
+        now = time.time()
+        await spin_log.log({"timestamp": now - 86400, "n": "kept"})
+
+        def failing_fsync(fd):
+            raise OSError("disk full")
+
+        monkeypatch.setattr("spin_log.os.fsync", failing_fsync)
+        # The batch spans two day segments; both are cut back
+        results = await asyncio.gather(
+            spin_log.log({"timestamp": now - 86400, "n": "lost"}),
+            spin_log.log({"timestamp": now, "n": "lost"}),
+            return_exceptions=True,
+        )
+        assert all(isinstance(result, OSError) for result in results)
+        monkeypatch.undo()
+
+        await spin_log.log({"timestamp": now, "n": "later"})
+        spin_log.close()
+        assert [record["n"] for record in SpinLog(str(tmp_path)).read()] == ["kept", "later"]
+
+    asyncio.run(run())
+
+
+def test_unencodable_record_fails_its_whole_batch(tmp_path):
+    spin_log = SpinLog(str(tmp_path))
+    now = time.time()
+    with pytest.raises(TypeError):
+        spin_log.write([{"timestamp": now, "n": 1}, {"timestamp": now, "n": object()}])
+    spin_log.append({"timestamp": now, "n": 2})
+    spin_log.close()
+    assert [record["n"] for record in SpinLog(str(tmp_path)).read()] == [2]
+
+
+def test_spin_settles_against_server_balance(tmp_path, monkeypatch):
+    pytest.importorskip("fastapi")
+    import main
+    from fastapi import HTTPException
+
+    async def run():
+        monkeypatch.setattr(main, "spin_log", SpinLog(str(tmp_path)))
+        monkeypatch.setattr(main, "settlement",
+                            Settlement(BalanceStore(initial_balance=100.0), max_delay=0.01))
+        red = main.Bet(type="red", numbers=sorted(main.RED_NUMBERS), amount=10, payout=0)
+        # The client's claimed balance is ignored
+        request = main.SpinRequest(bets=[red], balance=1000000.0, session_id="s")
+        result = await main.process_spin(request)
+        assert result.new_balance in (90.0, 110.0)
+        assert main.settlement.balance("s") == result.new_balance
+
+        too_much = main.SpinRequest(
+            bets=[main.Bet(type="straight", numbers=[7], amount=500, payout=0)],
+            balance=1000000.0,
+            session_id="s",
+        )
+        with pytest.raises(HTTPException):
+            await main.process_spin(too_much)
+
+        await main.settlement.close()
+        records = list(main.spin_log.read())
+        assert [record["balance"] for record in records] == [result.new_balance]
+        assert records[0]["delta"] == result.new_balance - 100.0
+
+    asyncio.run(run())
@@ -1,4 +1,4 @@
-import React, { useState } from 'react';
+import React, { useCallback, useEffect, useState } from 'react';
 import { useGameStore, CHIP_DENOMINATIONS, type Bet } from '../store/gameStore';
 import axios from 'axios';
 
@@ -11,6 +11,7 @@ const RED_NUMBERS = new Set([1, 3, 5, 7, 9, 12, 14, 16, 18, 19, 21, 23, 25, 27,
 
 export const GameControls: React.FC = () => {
   const {
+    sessionId,
     balance,
     bets,
     selectedChip,
@@ -34,6 +35,24 @@ export const GameControls: React.FC = () => {
 
   const totalStake = getTotalStake();
 
+  // The server holds the balance for this session; show its value
+  const syncBalance = useCallback(async () => {
+    try {
+      const response = await axios.get(`${API_URL}/balance`, {
+        params: { session_id: sessionId },
+        timeout: 10000,
+      });
+      setBalance(response.data.balance);
+    } catch (error) {
+      // The Vercel API has no /balance; keep the local balance there
+      console.warn('Could not load balance from the server:', error);
+    }
+  }, [sessionId, setBalance]);
+
+  useEffect(() => {
+    syncBalance();
+  }, [syncBalance]);
+
   const getBetAmount = (numbers: number[]): number => {
     return bets
       .filter((b) => JSON.stringify(b.numbers.sort()) === JSON.stringify(numbers.sort()))
@@ -74,6 +93,7 @@ export const GameControls: React.FC = () => {
       const requestPayload = {
         bets: apiBets,
         balance: balance,
+        session_id: sessionId,
       };
       
       console.log('=== REQUEST DETAILS ===');
@@ -143,6 +163,10 @@ export const GameControls: React.FC = () => {
         console.error('Error Detail:', errorDetail);
         console.error('Full Error Object:', error);
         
+        if (error.response?.status === 400) {
+          // The server's balance differs from ours, e.g. after play in another tab
+          syncBalance();
+        }
         alert(`Error: ${errorDetail || 'Failed to connect to backend'}\n\nCheck console for full details.`);
       } else {
         console.error('Non-axios error:', error);
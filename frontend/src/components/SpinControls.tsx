@@ -15,6 +15,7 @@ export const SpinControls: React.FC = () => {
     clearBets,
     getTotalStake,
     balance,
+    sessionId,
   } = useGameStore();
 
   const handleSpin = async () => {
@@ -43,6 +44,7 @@ export const SpinControls: React.FC = () => {
       const response = await axios.post(`${API_URL}/spin`, {
         bets: apiBets,
         balance: balance,
+        session_id: sessionId,
       });
 
       const result = response.data;
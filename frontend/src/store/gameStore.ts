@@ -16,6 +16,7 @@ export interface SpinResult {
 }
 
 export interface GameState {
+  sessionId: string;
   balance: number;
   bets: Bet[];
   lastSpin: number | null;
@@ -39,6 +40,14 @@ export interface GameState {
 
 const CHIP_DENOMINATIONS = [1, 5, 25, 100, 500, 1000];
 
+// Each browser spins against its own server-side balance
+const newSessionId = (): string => {
+  if (typeof crypto !== 'undefined' && typeof crypto.randomUUID === 'function') {
+    return crypto.randomUUID();
+  }
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+};
+
 // Load initial state from localStorage (with reset option)
 const loadInitialState = () => {
   try {
@@ -48,6 +57,7 @@ const loadInitialState = () => {
       localStorage.removeItem('roulette-game-storage');
       localStorage.setItem('roulette-reset', 'false');
       return {
+        sessionId: newSessionId(),
         balance: 10000,
         history: [],
       };
@@ -57,6 +67,7 @@ const loadInitialState = () => {
     if (stored) {
       const parsed = JSON.parse(stored);
       return {
+        sessionId: parsed.sessionId ?? newSessionId(),
         balance: parsed.balance ?? 10000,
         history: parsed.history ?? [],
       };
@@ -65,6 +76,7 @@ const loadInitialState = () => {
     console.error('Failed to load state from localStorage', e);
   }
   return {
+    sessionId: newSessionId(),
     balance: 10000,
     history: [],
   };
@@ -73,6 +85,7 @@ const loadInitialState = () => {
 const initialState = loadInitialState();
 
 export const useGameStore = create<GameState>()((set, get) => ({
+      sessionId: initialState.sessionId,
       balance: initialState.balance,
       bets: [],
       lastSpin: null,
@@ -145,7 +158,9 @@ export const useGameStore = create<GameState>()((set, get) => ({
         if (typeof window !== 'undefined') {
           localStorage.removeItem('roulette-game-storage');
         }
+        // A fresh session starts from the server's initial balance
         set({
+          sessionId: newSessionId(),
           balance: 10000,
           bets: [],
           lastSpin: null,
@@ -164,6 +179,7 @@ if (typeof window !== 'undefined') {
   useGameStore.subscribe((state) => {
     try {
       localStorage.setItem('roulette-game-storage', JSON.stringify({
+        sessionId: state.sessionId,
         balance: state.balance,
         history: state.history,
       }));